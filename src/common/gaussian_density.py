@@ -1,6 +1,6 @@
 import copy
 import logging
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 import numpy.typing as npt
@@ -35,30 +35,155 @@ class GaussianDensity:
         next_P = np.linalg.multi_dot([next_F, state.P, next_F.T]) + motion_model.Q(dt)
         return Gaussian(next_x, next_P)
 
+    @staticmethod
+    def predict_vectorized(initial_states: GaussianMixture, motion_model: MotionModel, dt: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Performs Kalman prediction step for every mixture component, see predict
+
+        Args:
+            initial_states (GaussianMixture): N components
+            motion_model (MotionModel): a structure specifies the motion model parameters
+
+        Returns:
+            next_states (np.ndarray (N x state dimension)): predicted means
+            next_covariances (np.ndarray (N x state dimension x state dimension)): predicted covariances
+        """
+        states = initial_states.states_np
+        covariances = initial_states.covariances_np
+
+        if motion_model.is_linear:
+            # the same transition matrix for every component
+            next_F = motion_model.F(states[0], dt)
+            next_states = states @ next_F.T
+            next_covariances = next_F @ covariances @ next_F.T
+        else:
+            # Jacobian depends on state (coordinate turn), so it is evaluated per component
+            next_F = np.array([motion_model.F(state, dt) for state in states])
+            next_states = np.array([motion_model.f(state, dt) for state in states])
+            next_covariances = next_F @ covariances @ np.transpose(next_F, axes=(0, 2, 1))
+
+        next_covariances += motion_model.Q(dt)
+        return next_states, next_covariances
+
+    @staticmethod
+    def get_Kalman_gain_vectorized(initial_states: GaussianMixture, measurement_model: MeasurementModel):
+        """Computes the measurement independent part of the Kalman update for every mixture component
+
+        Args:
+            initial_states (GaussianMixture): N components
+            measurement_model (MeasurementModel): linear measurement model
+
+        Returns:
+            H_x (np.ndarray (measurement dimension x state dimension)): measurement model Jacobian
+            S (np.ndarray (N x measurement dimension x measurement dimension)): innovation covariances
+            K (np.ndarray (N x state dimension x measurement dimension)): Kalman gains
+            next_covariances (np.ndarray (N x state dimension x state dimension)): updated covariances
+            L (np.ndarray (N x measurement dimension x measurement dimension)): lower Cholesky factors of S
+        """
+        states = initial_states.states_np
+        covariances = initial_states.covariances_np
+
+        H_x = measurement_model.H(states)
+        # Innovation covariance
+        states_dot_H_x = covariances @ H_x.T
+        S = H_x @ states_dot_H_x + measurement_model.R
+
+        # Make sure matrix S is positive definite
+        S = 0.5 * (S + np.transpose(S, axes=(0, 2, 1)))
+
+        # S = L @ L.T, the factor is shared by the Kalman gain and likelihoods of all measurements
+        L = np.linalg.cholesky(S)
+
+        # K = P @ H.T @ inv(S), solved as L @ L.T @ K.T = H @ P with two triangular solves
+        whitened_H_P = GaussianDensity.solve_lower_triangular(L, np.transpose(states_dot_H_x, axes=(0, 2, 1)))
+        K = np.transpose(GaussianDensity.solve_transposed_lower_triangular(L, whitened_H_P), axes=(0, 2, 1))
+
+        state_vector_size = states.shape[1]
+        next_covariances = (np.eye(state_vector_size) - K @ H_x) @ covariances
+
+        return H_x, S, K, next_covariances, L
+
+    @staticmethod
+    def solve_lower_triangular(L: np.ndarray, B: np.ndarray) -> np.ndarray:
+        """Solves L @ X = B by forward substitution for a stack of lower triangular matrices,
+        it loops over the (small) measurement dimension only
+
+        Args:
+            L (np.ndarray (N x m x m)): lower triangular matrices, e.g. Cholesky factors of S
+            B (np.ndarray (N x m x k)): right hand sides
+
+        Returns:
+            X (np.ndarray (N x m x k))
+        """
+        X = np.empty(B.shape, dtype=np.result_type(L, B))
+        for row in range(L.shape[-1]):
+            X[:, row] = (B[:, row] - np.einsum("pj,pjk->pk", L[:, row, :row], X[:, :row])) / L[:, row, row, np.newaxis]
+        return X
+
+    @staticmethod
+    def solve_transposed_lower_triangular(L: np.ndarray, B: np.ndarray) -> np.ndarray:
+        """Solves L.T @ X = B by backward substitution for a stack of lower triangular matrices,
+        L is not transposed in memory
+
+        Args:
+            L (np.ndarray (N x m x m)): lower triangular matrices, e.g. Cholesky factors of S
+            B (np.ndarray (N x m x k)): right hand sides
+
+        Returns:
+            X (np.ndarray (N x m x k))
+        """
+        X = np.empty(B.shape, dtype=np.result_type(L, B))
+        for row in reversed(range(L.shape[-1])):
+            X[:, row] = (B[:, row] - np.einsum("pj,pjk->pk", L[:, row + 1 :, row], X[:, row + 1 :])) / L[:, row, row, np.newaxis]
+        return X
+
+    @staticmethod
+    def innovations_with_mahalanobis(states: np.ndarray, measurements: np.ndarray, H_x: np.ndarray, L: np.ndarray):
+        """Innovations of every measurement against every component and their squared Mahalanobis distances
+        via Cholesky factor S = L @ L.T: |L^-1 @ y|^2, one triangular solve per component for all measurements
+        instead of explicit inv(S)
+
+        Args:
+            states (np.ndarray (N x state dimension)): component means
+            measurements (np.ndarray (M x measurement dimension)): measurements
+            H_x (np.ndarray (measurement dimension x state dimension)): measurement model Jacobian
+            L (np.ndarray (N x measurement dimension x measurement dimension)): lower Cholesky factors of S
+
+        Returns:
+            innovations (np.ndarray (N x M x measurement dimension))
+            mahalanobis (np.ndarray (N x M))
+        """
+        innovations = measurements[np.newaxis, :, :] - (states @ H_x.T)[:, np.newaxis, :]
+        whitened_innovations = GaussianDensity.solve_lower_triangular(L, np.transpose(innovations, axes=(0, 2, 1)))
+        mahalanobis = np.einsum("pim,pim->pm", whitened_innovations, whitened_innovations)
+        return innovations, mahalanobis
+
+    @staticmethod
+    def cholesky_log_determinants(L: np.ndarray) -> np.ndarray:
+        """Log determinants of a stack of matrices from their lower Cholesky factors L (N x m x m)"""
+        return 2 * np.sum(np.log(np.diagonal(L, axis1=-2, axis2=-1)), axis=-1)
+
     @staticmethod
     def update_states_with_likelihoods_by_single_measurement(
         initial_states: GaussianMixture,
         measurement: np.ndarray,
         measurement_model: MeasurementModel,
+        kalman_gain: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None,
     ):
-        H_x = measurement_model.H(initial_states.states_np)
-        # Innovation covariance
-        S = H_x @ initial_states.covariances_np @ H_x.T + measurement_model.R
-
-        # Make sure matrix S is positive definite
-        S = 0.5 * (S + np.transpose(S, axes=(0, 2, 1)))
+        """Performs Kalman update of every mixture component with a single measurement
 
-        K = initial_states.covariances_np @ H_x.T @ np.linalg.inv(S)
+        Args:
+            kalman_gain (Tuple): precomputed (H_x, S, K, next_covariances, L), see get_Kalman_gain_vectorized,
+                                 reuse it when updating the same components with several measurements
+        """
+        if kalman_gain is None:
+            kalman_gain = GaussianDensity.get_Kalman_gain_vectorized(initial_states, measurement_model)
+        H_x, S, K, next_covariances, _ = kalman_gain
 
         measurement_row = np.vstack([measurement] * initial_states.size)
         fraction = measurement_row - measurement_model.h(initial_states.states_np.T).T
         with_K = np.einsum("ijk,ik->ij", K, fraction)
         new_states = initial_states.states_np + with_K
 
-        state_vector_size = initial_states.states_np[0].shape[0]
-
-        next_covariances = (np.eye(state_vector_size) - K @ H_x) @ initial_states.covariances_np
-
         next_states = [Gaussian(new_states[idx], next_covariances[idx]) for idx in range(initial_states.size)]
 
         measurements_bar = np.expand_dims(H_x, axis=0) @ initial_states.states_np.T
@@ -71,6 +196,90 @@ class GaussianDensity:
 
         return next_states, loglikelihoods_fast
 
+    @staticmethod
+    def update_states_with_likelihoods_by_multiple_measurements(
+        initial_states: GaussianMixture,
+        measurements: np.ndarray,
+        measurement_model: MeasurementModel,
+        kalman_gain: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None,
+    ):
+        """Performs Kalman update of every mixture component with every measurement in one batched pass
+
+        Args:
+            initial_states (GaussianMixture): N components
+            measurements (np.ndarray (M x measurement dimension)): measurements
+            measurement_model (MeasurementModel): linear measurement model
+            kalman_gain (Tuple): precomputed (H_x, S, K, next_covariances, L), see get_Kalman_gain_vectorized
+
+        Returns:
+            next_states (np.ndarray (N x M x state dimension)): updated means
+            next_covariances (np.ndarray (N x state dimension x state dimension)): updated covariances,
+                                                                                  they do not depend on measurement
+            loglikelihoods (np.ndarray (N x M)): predicted likelihood of each measurement for each component
+        """
+        if kalman_gain is None:
+            kalman_gain = GaussianDensity.get_Kalman_gain_vectorized(initial_states, measurement_model)
+        H_x, _, K, next_covariances, L = kalman_gain
+        states = initial_states.states_np
+
+        innovations, mahalanobis = GaussianDensity.innovations_with_mahalanobis(states, measurements, H_x, L)
+        next_states = np.einsum("pij,pmj->pmi", K, innovations)
+        next_states += states[:, np.newaxis, :]
+
+        log_determinants = GaussianDensity.cholesky_log_determinants(L)
+        # loglikelihoods are accumulated in place of mahalanobis buffer
+        loglikelihoods = np.add(mahalanobis, log_determinants[:, np.newaxis] + measurements.shape[1] * np.log(2 * np.pi), out=mahalanobis)
+        loglikelihoods *= -0.5
+
+        return next_states, next_covariances, loglikelihoods
+
+    @staticmethod
+    def update_states_with_likelihoods_in_gates(
+        initial_states: GaussianMixture,
+        measurements: np.ndarray,
+        measurement_model: MeasurementModel,
+        gating_size: float,
+        kalman_gain: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None,
+    ):
+        """Performs ellipsoidal gating and Kalman update of gated (component, measurement) pairs in one pass,
+        innovations and Mahalanobis distances of the gate are reused by the update.
+        A measurement outside of every gate is paired with its nearest component only
+        (a placeholder state, the measurement is clutter), see outside_gates.
+
+        Args:
+            initial_states (GaussianMixture): N components
+            measurements (np.ndarray (M x measurement dimension)): measurements
+            measurement_model (MeasurementModel): linear measurement model
+            gating_size (float): gating size, compared with Mahalanobis distance of innovation covariance S
+            kalman_gain (Tuple): precomputed (H_x, S, K, next_covariances, L), see get_Kalman_gain_vectorized
+
+        Returns:
+            component_indices (np.ndarray (K)), measurement_indices (np.ndarray (K)): gated pairs
+                                                                                      ordered by measurement
+            next_states (np.ndarray (K x state dimension)): updated means of pairs
+            loglikelihoods (np.ndarray (K)): predicted likelihood of measurement for component of pairs
+            outside_gates (np.ndarray (M)): True for measurements outside of every gate
+        """
+        if kalman_gain is None:
+            kalman_gain = GaussianDensity.get_Kalman_gain_vectorized(initial_states, measurement_model)
+        H_x, _, K, _, L = kalman_gain
+        states = initial_states.states_np
+
+        innovations, mahalanobis = GaussianDensity.innovations_with_mahalanobis(states, measurements, H_x, L)
+
+        gating_matrix = mahalanobis < gating_size
+        outside_gates = ~gating_matrix.any(axis=0)
+        gating_matrix[np.argmin(mahalanobis[:, outside_gates], axis=0), np.flatnonzero(outside_gates)] = True
+        measurement_indices, component_indices = np.nonzero(gating_matrix.T)
+
+        next_states = np.einsum("kij,kj->ki", K[component_indices], innovations[component_indices, measurement_indices])
+        next_states += states[component_indices]
+
+        log_determinants = GaussianDensity.cholesky_log_determinants(L)
+        loglikelihoods = -0.5 * (measurements.shape[1] * np.log(2 * np.pi) + log_determinants[component_indices] + mahalanobis[component_indices, measurement_indices])
+
+        return component_indices, measurement_indices, next_states, loglikelihoods, outside_gates
+
     @staticmethod
     def numpy_get_Kalman_gain(initial_states: GaussianMixture, measurement_model: MeasurementModel):
         H_x = measurement_model.H(initial_states["gaussian"]["means"])
@@ -312,6 +521,51 @@ class GaussianDensity:
         z_ingate = z[indices_in_gate]
         return z_ingate, indices_in_gate
 
+    @staticmethod
+    def ellipsoidal_gating_vectorized(
+        states: np.ndarray,
+        covariances: np.ndarray,
+        z: np.ndarray,
+        measurement_model: MeasurementModel,
+        gating_size: float,
+    ) -> np.ndarray:
+        """Performs ellipsoidal gating for N objects and M measurements in one batched pass
+
+        Args:
+            states (np.ndarray (N x state dimension)): means of predicted states
+            covariances (np.ndarray (N x state dimension x state dimension)): covariances of predicted states
+            z (np.ndarray (M x measurements dimension)): measurements
+            measurement_model (MeasurementModel): specifies the measurement model parameters
+            gating_size (float): gating size
+
+        Returns:
+            meas_in_gate (np.ndarray (N x M)): boolean matrix indicating whether
+                                               the corresponding measurement is
+                                               in the gate of the corresponding object
+        """
+        assert z.shape[1] == measurement_model.dim
+
+        # Measurements model Jacobian
+        H_x = measurement_model.H(states)
+
+        # Innovation covariance
+        S = H_x @ covariances @ H_x.T
+
+        # Make sure matrix S is positive definite
+        S = 0.5 * (S + np.transpose(S, axes=(0, 2, 1)))
+        try:
+            S_inv = np.linalg.inv(S)
+        except np.linalg.LinAlgError:
+            logging.warning("It seems, cannot inverse S, get pseudo inverse matrix")
+            S_inv = np.linalg.pinv(S)
+
+        # Difference between measurements and predictions (N x M x measurements dimension)
+        z_diff = z[np.newaxis, :, :] - (states @ H_x.T)[:, np.newaxis, :]
+
+        # Squared Mahalanobis distances
+        Machlanobis_dist = np.einsum("pmi,pij,pmj->pm", z_diff, S_inv, z_diff)
+        return Machlanobis_dist < gating_size
+
     @staticmethod
     def moment_matching(weights: List[float], states: List[Gaussian]) -> Gaussian:
         """Aproximates a Gaussian mixture density as a single Gaussian using moment matching
@@ -370,6 +624,56 @@ class GaussianDensity:
         matched_state = Gaussian(x=x_bar_np, P=P_bar_np)
         return matched_state
 
+    @staticmethod
+    def moment_matching_batched(weights: np.ndarray, states: np.ndarray, covariances: np.ndarray, weights_in_log_domain: bool = True):
+        """Aproximates M Gaussian mixture densities sharing N covariances
+        as M single Gaussians using moment matching (same spread term as moment_matching_vectorized)
+
+        Args:
+            weights (np.ndarray (N x M)): weights of Gaussian components normalized along N
+            states (np.ndarray (N x M x state dimension)): means of Gaussian components
+            covariances (np.ndarray (N x state dimension x state dimension)): covariances of Gaussian components
+            weights_in_log_domain (bool): True if weights are in logarithm domain, False if in decimal scale
+
+        Returns:
+            x_bar (np.ndarray (M x state dimension)): means of resulted mixtures
+            P_bar (np.ndarray (M x state dimension x state dimension)): covariances of resulted mixtures
+        """
+        weights = np.exp(weights) if weights_in_log_domain else weights
+
+        x_bar = np.einsum("pm,pmi->mi", weights, states)
+        delta_states = x_bar[np.newaxis, :, :] - states
+        spread = np.einsum("pm,pmi,pmi->m", weights, delta_states, delta_states)
+
+        P_bar = np.einsum("pm,pij->mij", weights, covariances) + spread[:, np.newaxis, np.newaxis]
+        return x_bar, P_bar
+
+    @staticmethod
+    def moment_matching_segments(weights: np.ndarray, states: np.ndarray, covariances: np.ndarray, segment_starts: np.ndarray, weights_in_log_domain: bool = True):
+        """Aproximates M Gaussian mixture densities stored one after another
+        as M single Gaussians using moment matching (same spread term as moment_matching_vectorized)
+
+        Args:
+            weights (np.ndarray (K)): weights of Gaussian components normalized inside every mixture
+            states (np.ndarray (K x state dimension)): means of Gaussian components
+            covariances (np.ndarray (K x state dimension x state dimension)): covariances of Gaussian components
+            segment_starts (np.ndarray (M)): index of the first component of every mixture, mixtures are not empty
+            weights_in_log_domain (bool): True if weights are in logarithm domain, False if in decimal scale
+
+        Returns:
+            x_bar (np.ndarray (M x state dimension)): means of resulted mixtures
+            P_bar (np.ndarray (M x state dimension x state dimension)): covariances of resulted mixtures
+        """
+        weights = np.exp(weights) if weights_in_log_domain else weights
+        segment_indices = np.repeat(np.arange(len(segment_starts)), np.diff(np.append(segment_starts, len(weights))))
+
+        x_bar = np.add.reduceat(weights[:, np.newaxis] * states, segment_starts, axis=0)
+        delta_states = x_bar[segment_indices] - states
+        spread = np.add.reduceat(weights * np.einsum("ki,ki->k", delta_states, delta_states), segment_starts)
+
+        P_bar = np.add.reduceat(weights[:, np.newaxis, np.newaxis] * covariances, segment_starts, axis=0) + spread[:, np.newaxis, np.newaxis]
+        return x_bar, P_bar
+
     @staticmethod
     def mixture_reduction(weights, states, threshold):
         """Uses a greedy merging method to reduce the number of Gaussian components
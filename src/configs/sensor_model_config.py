@@ -22,6 +22,8 @@ class SensorModelConfig:
             uniform clutter density
         intensity_c : float
             uniform clutter intensity
+        log_intensity_c : float
+            uniform clutter intensity in logarithm domain
         """
         self.P_D = P_D
         self.lambda_c = lambda_c
@@ -29,6 +31,7 @@ class SensorModelConfig:
         self.V = np.prod(np.diff(self.range_c))  # Volume
         self.pdf_c = 1 / self.V  # Spatial PDF
         self.intensity_c = self.lambda_c / self.V  # expected number of clutter detections per unit volume
+        self.log_intensity_c = float(np.log(self.intensity_c))
 
     def __repr__(self) -> str:
         return self.__class__.__name__ + (
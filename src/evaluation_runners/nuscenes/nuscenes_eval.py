@@ -232,6 +232,7 @@ class NuscenesTrackerEvaluator:
                 result_estimations[sample_token] = nuscenes_results
                 result_results_scene.update(nuscenes_results)
 
+        tracker.close()
         evaluator.post_processing()
         return result_results_scene
 
@@ -2,6 +2,10 @@ import numpy as np
 
 
 class MotionModel:
+    # True if transition matrix F does not depend on the state vector,
+    # then it is evaluated once for all states, see GaussianDensity.predict_vectorized
+    is_linear = False
+
     def __init__(self, random_state: int, d: int, *args, **kwargs):
         self._generator = np.random.RandomState(random_state)
         self.d = d
@@ -20,6 +24,8 @@ class MotionModel:
 
 
 class ConstantVelocityMotionModel(MotionModel):
+    is_linear = True
+
     def __init__(self, random_state: int, sigma_q: float, *args, **kwargs):
         super().__init__(random_state, d=4)  # 4 states: x, y, vx, vy
         self.sigma = sigma_q
@@ -65,6 +71,8 @@ class CoordinateTurnMotionModel(MotionModel):
 
 
 class ConstantAccelerationMotionModel(MotionModel):
+    is_linear = True
+
     def __init__(self, random_state: int, sigma_a: float, *args, **kwargs):
         super().__init__(random_state, d=6)  # 6 states: x, y, vx, vy, ax, ay
         self.sigma_a = sigma_a
@@ -4,7 +4,10 @@ from src.trackers.multiple_object_trackers.PMBM.common.assigner import (
     AssignmentSolver,
     assign,
 )
-from src.trackers.multiple_object_trackers.PMBM.common.bernoulli import Bernoulli
+from src.trackers.multiple_object_trackers.PMBM.common.bernoulli import (
+    Bernoulli,
+    BernoulliArray,
+)
 from src.trackers.multiple_object_trackers.PMBM.common.birth_model import (
     BirthModel,
     MeasurementDrivenBirthModel,
@@ -1,3 +1,6 @@
+from dataclasses import dataclass
+from typing import List, Tuple
+
 import numpy as np
 
 from src.common import Gaussian, GaussianDensity, ObjectMetadata
@@ -18,9 +21,31 @@ class Bernoulli:
 
     def __init__(self, state: Gaussian, existence_probability: float, metadata: ObjectMetadata = None):
         self.state: Gaussian = state
-        self.existence_probability: float = existence_probability
+        # storage of existence probability, a BernoulliArray binds it to an element of its array
+        self._existence_probabilities = None
+        self._index = None
+        self._existence_probability = existence_probability
         self.metadata = metadata
 
+    @property
+    def existence_probability(self) -> float:
+        if self._existence_probabilities is None:
+            return self._existence_probability
+        return self._existence_probabilities[self._index]
+
+    @existence_probability.setter
+    def existence_probability(self, existence_probability: float) -> None:
+        if self._existence_probabilities is None:
+            self._existence_probability = existence_probability
+        else:
+            self._existence_probabilities[self._index] = existence_probability
+
+    def bind(self, existence_probabilities: np.ndarray, index: int) -> None:
+        """Makes the Bernoulli a view of existence_probabilities[index]"""
+        existence_probabilities[index] = self.existence_probability
+        self._existence_probabilities = existence_probabilities
+        self._index = index
+
     def __repr__(self) -> str:
         return self.__class__.__name__ + (f"(r={self.existence_probability:.4f}, " f"state={self.state}")
 
@@ -68,9 +93,6 @@ class Bernoulli:
         """Calculates the predicted likelihood for a given local hypothesis.
         NOTE page 86 lecture 04
         """
-
-        assert isinstance(meas_model, MeasurementModel)
-
         log_likelihood_detected = density.predict_loglikelihood(self.state, measurement, meas_model) + np.log(detection_probability) + np.log(self.existence_probability)
         return log_likelihood_detected
 
@@ -84,8 +106,62 @@ class Bernoulli:
         NOTE: page 85 lecture 04
 
         """
-        assert isinstance(meas_model, MeasurementModel)
-
         updated_density = density.update(self.state, measurement, meas_model)
         update_bern = Bernoulli(state=updated_density, existence_probability=1.0)
         return update_bern
+
+
+@dataclass
+class BernoulliArray:
+    """Bernoulli components stored as structure of arrays,
+    indexing returns a Bernoulli which is a view of the existence probabilities array
+
+    Parameters
+    ----------
+    existence_probability : np.ndarray (N)
+        probabilities of existence
+    states : List[Gaussian]
+        structs contain parameters describing the objects pdf
+    """
+
+    existence_probability: np.ndarray
+    states: List[Gaussian]
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __getitem__(self, idx: int) -> Bernoulli:
+        bernoulli = Bernoulli(self.states[idx], self.existence_probability[idx])
+        bernoulli.bind(self.existence_probability, idx)
+        return bernoulli
+
+    @classmethod
+    def from_bernoullis(cls, bernoullis: List[Bernoulli], bind: bool = False):
+        """Gathers Bernoulli components into arrays.
+
+        bind : bool
+            if True, given Bernoullis become views of the new array, so it is the storage
+            of their existence probabilities and vectorized updates of it are seen by them
+        """
+        bernoulli_array = cls(
+            existence_probability=np.array([bernoulli.existence_probability for bernoulli in bernoullis], dtype=float),
+            states=[bernoulli.state for bernoulli in bernoullis],
+        )
+        if bind:
+            for idx, bernoulli in enumerate(bernoullis):
+                bernoulli.bind(bernoulli_array.existence_probability, idx)
+        return bernoulli_array
+
+    def predict_existence(self, survival_probability: float) -> None:
+        """Vectorized probability of survival * probability of existence, see Bernoulli.predict"""
+        self.existence_probability *= survival_probability
+
+    def undetected_update(self, detection_probability: float) -> Tuple["BernoulliArray", np.ndarray]:
+        """Vectorized Bernoulli.undetected_update_state and Bernoulli.undetected_update_loglikelihood
+        for all components at once.
+        NOTE: from page 88 lecture 04
+        """
+        likelihood_undetected = self.existence_probability * (1 - detection_probability)
+        likelihood_predicted = 1 - self.existence_probability + likelihood_undetected
+        posterior_bernoullis = BernoulliArray(likelihood_undetected / likelihood_predicted, self.states)
+        return posterior_bernoullis, np.log(likelihood_predicted)
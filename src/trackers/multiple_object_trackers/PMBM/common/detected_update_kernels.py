@@ -0,0 +1,314 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# numba and jax are optional (pip install -e .[numba,jax]), without them PoissonRFS uses the NumPy batched update
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import jax
+    import jax.numpy as jnp
+except ImportError:
+    jax = None
+
+NUMBA_AVAILABLE = njit is not None
+JAX_AVAILABLE = jax is not None
+# CPU build of jaxlib is slower than the numba kernel, JAX backend is used only on GPU/TPU
+JAX_ACCELERATED = JAX_AVAILABLE and jax.default_backend() != "cpu"
+
+if JAX_AVAILABLE:
+    try:
+        from jax.experimental import enable_x64 as _enable_x64
+    except ImportError:
+        # moved out of experimental in later jax releases
+        _enable_x64 = jax.enable_x64
+
+LOG_2PI = math.log(2 * math.pi)
+
+# smallest padded size of JAX update arrays, see jax_bucket_size
+JAX_MIN_BUCKET_SIZE = 8
+
+
+def jax_x64():
+    """Context in which JAX computes in double precision. PMBM likelihoods are compared
+    in logarithm domain, float32 is not enough for them. Global JAX config is left untouched."""
+    return _enable_x64(True)
+
+
+def jax_bucket_size(size: int) -> int:
+    """Size the arrays of _detected_update_jax are padded to (next power of two). Jitted function
+    is compiled for every input shape, padding limits it to a few compilations per PPP size range."""
+    return max(JAX_MIN_BUCKET_SIZE, 1 << (size - 1).bit_length())
+
+
+@dataclass
+class DetectedUpdateBuffers:
+    """Scratch arrays of the numba detected update kernel, allocated once and reused for every measurement"""
+
+    updated_means: np.ndarray
+    component_log_weights: np.ndarray
+    in_gate: np.ndarray
+    innovation: np.ndarray
+    whitened_innovation: np.ndarray
+
+    @classmethod
+    def allocate(cls, n_components: int, state_dim: int, meas_dim: int):
+        return cls(
+            updated_means=np.empty((n_components, state_dim)),
+            component_log_weights=np.empty(n_components),
+            in_gate=np.empty(n_components, dtype=np.bool_),
+            innovation=np.empty(meas_dim),
+            whitened_innovation=np.empty(meas_dim),
+        )
+
+
+def _make_detected_update_numba(state_dim: int):
+    """Builds the detected update kernel for a fixed state dimension, so loops over the state
+    have compile time length and are unrolled. The only closure variable is state_dim,
+    so the compiled kernel of every dimension is found in numba cache by a new process."""
+
+    def detected_update(
+        means: np.ndarray,
+        next_covariances: np.ndarray,
+        predicted_measurements: np.ndarray,
+        L: np.ndarray,
+        log_determinants: np.ndarray,
+        K: np.ndarray,
+        log_weights: np.ndarray,
+        measurement: np.ndarray,
+        log_detection_probability: float,
+        log_clutter_intensity: float,
+        gating_size: float,
+        updated_means: np.ndarray,
+        component_log_weights: np.ndarray,
+        in_gate: np.ndarray,
+        innovation: np.ndarray,
+        whitened_innovation: np.ndarray,
+    ):
+        """Updates every PPP component inside the gate of a single measurement and merges them into one Bernoulli.
+        A measurement outside of every gate is clutter, the nearest component updated alone is a placeholder state.
+
+        Args:
+            means (np.ndarray (N x state dimension)): means of PPP components
+            next_covariances (np.ndarray (N x state dimension x state dimension)): updated covariances
+            predicted_measurements (np.ndarray (N x measurement dimension)): H @ x of PPP components
+            L (np.ndarray (N x measurement dimension x measurement dimension)): lower Cholesky factors of innovation covariances
+            log_determinants (np.ndarray (N)): log determinants of innovation covariances
+            K (np.ndarray (N x state dimension x measurement dimension)): Kalman gains
+            log_weights (np.ndarray (N)): weights of PPP components in logarithm domain
+            measurement (np.ndarray (measurement dimension)): measurement
+            log_detection_probability (float): log(P_D)
+            log_clutter_intensity (float): log of clutter intensity
+            gating_size (float): gating size, compared with Mahalanobis distance of innovation covariance,
+                finite (kernel is compiled with fastmath), np.finfo(float).max to update with every component
+            updated_means, component_log_weights, in_gate, innovation, whitened_innovation (np.ndarray):
+                scratch arrays overwritten by the kernel, see DetectedUpdateBuffers
+
+        Returns:
+            merged_mean (np.ndarray (state dimension)): mean of the new Bernoulli
+            merged_covariance (np.ndarray (state dimension x state dimension)): covariance of the new Bernoulli
+            log_likelihood (float): likelihood of detection from a new object or clutter in logarithm domain
+            existence_probability (float): existence probability of the new Bernoulli
+        """
+        n_components = means.shape[0]
+        meas_dim = measurement.shape[0]
+
+        # 1. Gate and predicted likelihood of every PPP component
+        n_gated = 0
+        nearest_component = 0
+        nearest_mahalanobis = 0.0
+        for p in range(n_components):
+            for i in range(meas_dim):
+                innovation[i] = measurement[i] - predicted_measurements[p, i]
+            # Mahalanobis distance |L^-1 @ y|^2 by forward substitution
+            mahalanobis = 0.0
+            for i in range(meas_dim):
+                value = innovation[i]
+                for j in range(i):
+                    value -= L[p, i, j] * whitened_innovation[j]
+                whitened_innovation[i] = value / L[p, i, i]
+                mahalanobis += whitened_innovation[i] * whitened_innovation[i]
+            if p == 0 or mahalanobis < nearest_mahalanobis:
+                nearest_component, nearest_mahalanobis = p, mahalanobis
+            in_gate[p] = mahalanobis < gating_size
+            if in_gate[p]:
+                n_gated += 1
+                component_log_weights[p] = log_detection_probability + log_weights[p] - 0.5 * (meas_dim * LOG_2PI + log_determinants[p] + mahalanobis)
+        outside_gates = n_gated == 0
+        if outside_gates:
+            in_gate[nearest_component] = True
+            component_log_weights[nearest_component] = 0.0
+
+        # 2. Kalman update of gated components
+        for p in range(n_components):
+            if not in_gate[p]:
+                continue
+            for i in range(state_dim):
+                updated_mean = means[p, i]
+                for j in range(meas_dim):
+                    updated_mean += K[p, i, j] * (measurement[j] - predicted_measurements[p, j])
+                updated_means[p, i] = updated_mean
+
+        # 3. logsumexp of the gated component weights, weights are kept in decimal scale afterwards
+        # no -inf for components outside of the gate, fastmath assumes finite values
+        max_log_weight = 0.0
+        found_gated = False
+        for p in range(n_components):
+            if in_gate[p] and (not found_gated or component_log_weights[p] > max_log_weight):
+                max_log_weight = component_log_weights[p]
+                found_gated = True
+        sum_weights = 0.0
+        for p in range(n_components):
+            component_log_weights[p] = math.exp(component_log_weights[p] - max_log_weight) if in_gate[p] else 0.0
+            sum_weights += component_log_weights[p]
+        log_sum = max_log_weight + math.log(sum_weights)
+
+        # 4. Moment matching (same spread term as GaussianDensity.moment_matching_vectorized)
+        merged_mean = np.zeros(state_dim)
+        for p in range(n_components):
+            if not in_gate[p]:
+                continue
+            weight = component_log_weights[p] / sum_weights
+            for i in range(state_dim):
+                merged_mean[i] += weight * updated_means[p, i]
+
+        merged_covariance = np.zeros((state_dim, state_dim))
+        spread = 0.0
+        for p in range(n_components):
+            if not in_gate[p]:
+                continue
+            weight = component_log_weights[p] / sum_weights
+            squared_distance = 0.0
+            for i in range(state_dim):
+                delta = merged_mean[i] - updated_means[p, i]
+                squared_distance += delta * delta
+            spread += weight * squared_distance
+            for i in range(state_dim):
+                for j in range(state_dim):
+                    merged_covariance[i, j] += weight * next_covariances[p, i, j]
+        for i in range(state_dim):
+            for j in range(state_dim):
+                merged_covariance[i, j] += spread
+
+        # 5. Stable two-term logsumexp with clutter and existence probability
+        if outside_gates:
+            return merged_mean, merged_covariance, log_clutter_intensity, 0.0
+        log_likelihood = max(log_sum, log_clutter_intensity) + math.log1p(math.exp(-abs(log_sum - log_clutter_intensity)))
+        existence_probability = math.exp(log_sum - log_likelihood)
+        return merged_mean, merged_covariance, log_likelihood, existence_probability
+
+    # Own name per state dimension: numba names compiled symbols and cache files after the qualified name,
+    # kernels of different dimensions compiled in different processes must not collide in the cache
+    detected_update.__name__ = f"detected_update_{state_dim}d"
+    detected_update.__qualname__ = f"{_make_detected_update_numba.__qualname__}.<locals>.{detected_update.__name__}"
+    if NUMBA_AVAILABLE:
+        # nogil lets PoissonRFS.detected_update_numba run measurements in parallel threads
+        return njit(cache=True, fastmath=True, nogil=True)(detected_update)
+    return detected_update
+
+
+# Kernels for constant velocity (4) and coordinate turn (5) states, other dimensions are built on first use
+_DETECTED_UPDATE_KERNELS = {state_dim: _make_detected_update_numba(state_dim) for state_dim in (4, 5)}
+
+
+def get_detected_update_kernel(state_dim: int):
+    if state_dim not in _DETECTED_UPDATE_KERNELS:
+        _DETECTED_UPDATE_KERNELS[state_dim] = _make_detected_update_numba(state_dim)
+    return _DETECTED_UPDATE_KERNELS[state_dim]
+
+
+def _component_kalman_gain_jax(mean, covariance, H, R):
+    """Measurement independent part of Kalman update for one PPP component"""
+    S = H @ covariance @ H.T + R
+    S = 0.5 * (S + S.T)
+    L = jnp.linalg.cholesky(S)
+    K = jax.scipy.linalg.cho_solve((L, True), H @ covariance).T
+    next_covariance = (jnp.eye(mean.shape[0]) - K @ H) @ covariance
+    log_determinant = 2 * jnp.sum(jnp.log(jnp.diagonal(L)))
+    return H @ mean, L, K, next_covariance, log_determinant
+
+
+def _component_update_jax(mean, predicted_measurement, L, K, log_determinant, measurement):
+    """Kalman update of one PPP component with one measurement, its predicted likelihood and Mahalanobis distance"""
+    innovation = measurement - predicted_measurement
+    whitened_innovation = jax.scipy.linalg.solve_triangular(L, innovation, lower=True)
+    mahalanobis = whitened_innovation @ whitened_innovation
+    loglikelihood = -0.5 * (measurement.shape[0] * LOG_2PI + log_determinant + mahalanobis)
+    return mean + K @ innovation, loglikelihood, mahalanobis
+
+
+def _detected_update_single_jax(
+    measurement,
+    means,
+    predicted_measurements,
+    L,
+    K,
+    next_covariances,
+    log_determinants,
+    log_weights,
+    log_detection_probability,
+    log_clutter_intensity,
+    gating_size,
+):
+    """Updates every PPP component inside the gate of a single measurement and merges them into one Bernoulli,
+    see _make_detected_update_numba"""
+    updated_means, loglikelihoods, mahalanobis = jax.vmap(_component_update_jax, in_axes=(0, 0, 0, 0, 0, None))(means, predicted_measurements, L, K, log_determinants, measurement)
+    # a measurement outside of every gate is clutter, its nearest component gives a placeholder state
+    in_gate = mahalanobis < gating_size
+    outside_gates = ~jnp.any(in_gate)
+    in_gate = jnp.where(outside_gates, jnp.arange(means.shape[0]) == jnp.argmin(mahalanobis), in_gate)
+    component_log_weights = jnp.where(in_gate, log_detection_probability + log_weights + loglikelihoods, -jnp.inf)
+
+    log_sum = jax.scipy.special.logsumexp(component_log_weights, axis=0)
+    weights = jnp.exp(component_log_weights - log_sum)
+    log_sum = jnp.where(outside_gates, -jnp.inf, log_sum)
+
+    # Moment matching (same spread term as GaussianDensity.moment_matching_vectorized)
+    merged_mean = weights @ updated_means
+    spread = weights @ jnp.sum((merged_mean - updated_means) ** 2, axis=1)
+    merged_covariance = jnp.einsum("p,pij->ij", weights, next_covariances) + spread
+
+    log_likelihood = jnp.logaddexp(log_sum, log_clutter_intensity)
+    existence_probability = jnp.exp(log_sum - log_likelihood)
+    return merged_mean, merged_covariance, log_likelihood, existence_probability
+
+
+def _detected_update_jax(means, covariances, log_weights, measurements, H, R, log_detection_probability, log_clutter_intensity, gating_size):
+    """Updates PPP with every measurement, vectorized over measurements and PPP components
+
+    Args:
+        means (N x state dimension), covariances (N x state dimension x state dimension),
+        log_weights (N): PPP intensity
+        measurements (M x measurement dimension): measurements
+        H (measurement dimension x state dimension), R (measurement dimension x measurement dimension):
+            linear measurement model
+        gating_size: gating size, compared with Mahalanobis distance of innovation covariance,
+            inf to update with every component
+
+    Returns:
+        merged_means (M x state dimension), merged_covariances (M x state dimension x state dimension),
+        log_likelihoods (M), existence_probabilities (M): new Bernoulli per measurement
+    """
+    predicted_measurements, L, K, next_covariances, log_determinants = jax.vmap(_component_kalman_gain_jax, in_axes=(0, 0, None, None))(means, covariances, H, R)
+    return jax.vmap(_detected_update_single_jax, in_axes=(0,) + (None,) * 10)(
+        measurements,
+        means,
+        predicted_measurements,
+        L,
+        K,
+        next_covariances,
+        log_determinants,
+        log_weights,
+        log_detection_probability,
+        log_clutter_intensity,
+        gating_size,
+    )
+
+
+if JAX_AVAILABLE:
+    _detected_update_jax = jax.jit(_detected_update_jax)
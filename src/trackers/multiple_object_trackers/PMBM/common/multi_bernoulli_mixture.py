@@ -1,6 +1,6 @@
 import logging
 from collections import defaultdict
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 
@@ -8,7 +8,9 @@ import numpy as np
 from .....common import normalize_log_weights
 from .....measurement_models import MeasurementModel
 from .....motion_models import MotionModel
+from .bernoulli import BernoulliArray
 from .global_hypothesis import GlobalHypothesis
+from .single_target_hypothesis import SingleTargetHypothesis
 from .track import Track
 
 
@@ -18,6 +20,10 @@ class MultiBernouilliMixture:
     def __init__(self):
         self.tracks = {}
         self.global_hypotheses: List[GlobalHypothesis] = []
+        # existence probabilities of all single target hypotheses as one array (structure of arrays),
+        # Bernoullis of the hypotheses are views of it, see BernoulliArray.from_bernoullis
+        self.bernoullis: BernoulliArray = None
+        self._bernoullis_hypotheses: List[SingleTargetHypothesis] = []
 
     def __repr__(self) -> str:
         return self.__class__.__name__ + " " + (f"num of tracks= {len(self.tracks)}, " f"num global hypotheses={len(self.global_hypotheses)}, ")
@@ -55,15 +61,22 @@ class MultiBernouilliMixture:
         density_handler,
         dt: float,
     ) -> None:
-        # MBM predict
-        for track in self.tracks.values():
-            for sth in track.single_target_hypotheses.values():
-                sth.bernoulli.predict(
-                    motion_model,
-                    survival_probability,
-                    density_handler,
-                    dt,
-                )
+        # MBM predict, Kalman prediction per state, existence probabilities at once
+        for _, sth in self.single_target_hypotheses():
+            sth.bernoulli.state = density_handler.predict(sth.bernoulli.state, motion_model, dt)
+        self.get_bernoullis().predict_existence(survival_probability)
+
+    def single_target_hypotheses(self) -> List[Tuple[Track, SingleTargetHypothesis]]:
+        return [(track, sth) for track in self.tracks.values() for sth in track.single_target_hypotheses.values()]
+
+    def get_bernoullis(self) -> BernoulliArray:
+        """Returns the structure of arrays of current single target hypotheses Bernoullis,
+        it is gathered again only if hypotheses changed since the last call"""
+        hypotheses = [sth for _, sth in self.single_target_hypotheses()]
+        if self.bernoullis is None or len(hypotheses) != len(self._bernoullis_hypotheses) or any(a is not b for a, b in zip(hypotheses, self._bernoullis_hypotheses)):
+            self.bernoullis = BernoulliArray.from_bernoullis([sth.bernoulli for sth in hypotheses], bind=True)
+            self._bernoullis_hypotheses = hypotheses
+        return self.bernoullis
 
     def gating(self, z: np.ndarray, density_handler, meas_model: MeasurementModel, gating_size):
         gating_matrix = defaultdict(lambda: defaultdict(lambda: False))
@@ -82,6 +95,7 @@ class MultiBernouilliMixture:
     def update(
         self,
         detection_probability: float,
+        log_detection_probability: float,
         measurements: np.ndarray,
         meas_model,
         density,
@@ -94,21 +108,30 @@ class MultiBernouilliMixture:
         used_meas_indices : (hyp_tree_idx x bern_idx x meas_idx)
             [description]
         """
+        # measurement model is checked once here, not in per-measurement Bernoulli updates
+        assert isinstance(meas_model, MeasurementModel)
         logging.debug("\n Creating new STH in MBM")
-        for track in self.tracks.values():
-            for sth in track.single_target_hypotheses.values():
-                logging.debug(f"\n For hypothesis: track_id={track.track_id} sth_id={sth.sth_id} {sth}")
-
-                sth.missdetection_hypothesis = sth.create_missdetection_hypothesis(detection_probability, track.get_new_sth_id())
-                logging.debug(f"Created missdetection hypothesis {sth}")
-
-                sth.detection_hypotheses = sth.create_detection_hypotheses(
-                    measurements,
-                    detection_probability,
-                    meas_model,
-                    density,
-                    [track.get_new_sth_id() for i in range(len(measurements))],
-                )
+        single_target_hypotheses = self.single_target_hypotheses()
+        missdetection_bernoullis, missdetection_loglikelihoods = self.get_bernoullis().undetected_update(detection_probability)
+
+        for idx, (track, sth) in enumerate(single_target_hypotheses):
+            logging.debug(f"\n For hypothesis: track_id={track.track_id} sth_id={sth.sth_id} {sth}")
+
+            sth.missdetection_hypothesis = SingleTargetHypothesis(
+                bernoulli=missdetection_bernoullis[idx],
+                log_likelihood=missdetection_loglikelihoods[idx].item(),
+                cost=0,
+                sth_id=track.get_new_sth_id(),
+            )
+            logging.debug(f"Created missdetection hypothesis {sth}")
+
+            sth.detection_hypotheses = sth.create_detection_hypotheses(
+                measurements,
+                log_detection_probability,
+                meas_model,
+                density,
+                [track.get_new_sth_id() for i in range(len(measurements))],
+            )
 
     def prune_global_hypotheses(self, log_threshold: float) -> None:
         """Removes Bernoulli components with small probability of existence and reindex the hypothesis table.
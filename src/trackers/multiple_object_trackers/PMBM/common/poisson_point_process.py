@@ -1,30 +1,54 @@
-from copy import deepcopy
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from functools import partial
 from typing import List, Tuple
 
 import numpy as np
-import scipy
 
 from src.common import (
+    Gaussian,
     GaussianDensity,
     GaussianMixture,
     Observation,
     ObservationList,
-    normalize_log_weights,
 )
 from src.measurement_models import MeasurementModel
 from src.motion_models import MotionModel
 from src.utils.timer import Timer
 
 from .bernoulli import Bernoulli
+from .detected_update_kernels import (
+    JAX_ACCELERATED,
+    NUMBA_AVAILABLE,
+    DetectedUpdateBuffers,
+    _detected_update_jax,
+    get_detected_update_kernel,
+    jax_bucket_size,
+    jax_x64,
+)
 from .single_target_hypothesis import SingleTargetHypothesis
 from .track import Track
 
 
 class PoissonRFS:
-    def __init__(self, intensity: GaussianMixture):
+    def __init__(self, intensity: GaussianMixture, jax_min_problem_size: int = 50000, threads_min_problem_size: int = 5000):
+        """
+        jax_min_problem_size : int
+            PPP size x number of measurements from which detected update runs on JAX device
+            (if jax runs on GPU/TPU), smaller problems are not worth the transfer and dispatch cost
+        threads_min_problem_size : int
+            PPP size x number of measurements from which numba detected update
+            is split over measurements between threads
+        """
         assert isinstance(intensity, GaussianMixture)
-        self.intensity = deepcopy(intensity)
+        # Weights and Gaussians of components are reassigned, never mutated in place,
+        # so a shallow copy of components is enough to keep the caller intensity untouched
+        self.intensity = GaussianMixture([replace(ppp_component) for ppp_component in intensity])
+        self.jax_min_problem_size = jax_min_problem_size
+        self.threads_min_problem_size = threads_min_problem_size
+        # thread pool of the threaded numba detected update, created on first use and kept between scans
+        self._executor: ThreadPoolExecutor = None
 
     def __repr__(self):
         return self.intensity.__repr__()
@@ -35,34 +59,64 @@ class PoissonRFS:
     def get_targets_detected_for_first_time(
         self,
         measurements: ObservationList,
-        clutter_intensity: float,
+        log_clutter_intensity: float,
         meas_model: MeasurementModel,
-        detection_probability: float,
+        log_detection_probability: float,
+        gating_size: float = None,
     ) -> List[Track]:
-        detected_update_func = partial(
-            PoissonRFS.detected_update,
+        """Creates a new track for every measurement from the PPP detected update
+
+        gating_size : float
+            if given, each measurement updates only PPP components inside its gate,
+            see gated_detected_update
+        """
+        # the only type check of the PPP update path, backends below do not repeat it
+        assert isinstance(meas_model, MeasurementModel)
+        detected_update_func = self.select_detected_update(len(measurements), gating_size)
+        new_single_target_hypotheses = detected_update_func(
+            measurements,
             intensity=self.intensity,
             meas_model=meas_model,
-            detection_probability=detection_probability,
-            clutter_intensity=clutter_intensity,
+            log_detection_probability=log_detection_probability,
+            log_clutter_intensity=log_clutter_intensity,
         )
 
-        new_single_target_hypotheses = [detected_update_func((meas_idx, measurements[meas_idx])) for meas_idx in range(len(measurements))]
+        return {new_track.track_id: new_track for new_track in map(Track.from_sth, new_single_target_hypotheses)}
+
+    def select_detected_update(self, num_of_measurements: int, gating_size: float = None):
+        """Chooses the fastest available implementation of detected_update_batch (or gated_detected_update
+        if gating_size is given) for the problem size, every backend supports gating"""
+        problem_size = len(self.intensity) * num_of_measurements
+        if JAX_ACCELERATED and problem_size >= self.jax_min_problem_size:
+            return partial(PoissonRFS.detected_update_jax, gating_size=gating_size)
+        if NUMBA_AVAILABLE:
+            if problem_size >= self.threads_min_problem_size:
+                return partial(PoissonRFS.detected_update_numba, max_workers=os.cpu_count() or 1, executor=self.get_executor(), gating_size=gating_size)
+            return partial(PoissonRFS.detected_update_numba, gating_size=gating_size)
+        if gating_size is not None:
+            return partial(PoissonRFS.gated_detected_update, gating_size=gating_size)
+        return PoissonRFS.detected_update_batch
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        return self._executor
 
-        new_tracks = {}
-        for meas_idx in range(len(measurements)):
-            new_track = Track.from_sth(new_single_target_hypotheses[meas_idx])
-            new_tracks[new_track.track_id] = new_track
-        return new_tracks
+    def close(self):
+        """Shuts down the thread pool of the threaded numba detected update, it is created again on next use"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
     @staticmethod
     def detected_update(
         meas: Tuple[int, Observation],
         intensity,
         meas_model: MeasurementModel,
-        detection_probability: float,
-        clutter_intensity: float,
+        log_detection_probability: float,
+        log_clutter_intensity: float,
         density=GaussianDensity,
+        kalman_gain: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None,
     ) -> SingleTargetHypothesis:
         """Creates a new local hypothesis by updating the PPP
         with measurement and calculates the corresponding
@@ -77,31 +131,61 @@ class PoissonRFS:
 
         NOTE: p.152 in presentation
 
+        kalman_gain Tuple
+            measurement independent (H_x, S, K, next_covariances, L) of the intensity,
+            see GaussianDensity.get_Kalman_gain_vectorized. Pass it when calling
+            for several measurements in a row to avoid recomputing it.
         """
         meas_idx, measurement = meas
-        assert isinstance(meas_model, MeasurementModel)
-        # 1. For each mixture component in the PPP intensity, perform Kalman update and
-        # calculate the predicted likelihood for each detection inside the corresponding ellipsoidal gate.
+        (new_single_target_hypothesis,) = PoissonRFS.detected_update_batch(
+            np.atleast_2d(measurement),
+            intensity,
+            meas_model,
+            log_detection_probability,
+            log_clutter_intensity,
+            density,
+            kalman_gain,
+        )
+        new_single_target_hypothesis.meas_idx = meas_idx
+        return new_single_target_hypothesis
+
+    @staticmethod
+    def detected_update_batch(
+        measurements: np.ndarray,
+        intensity: GaussianMixture,
+        meas_model: MeasurementModel,
+        log_detection_probability: float,
+        log_clutter_intensity: float,
+        density=GaussianDensity,
+        kalman_gain: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None,
+    ) -> List[SingleTargetHypothesis]:
+        """Creates a new local hypothesis for every measurement by updating the PPP
+        with all measurements in one vectorized pass, see detected_update.
 
-        # TODO remove redundant deep copy - it takes 0.012 secs
+        measurements np.ndarray
+            number of measurements x measurement dimension
+        """
+        # 1. For each mixture component in the PPP intensity, perform Kalman update and
+        # calculate the predicted likelihood for each detection (PPP size x number of measurements).
         (
-            updated_ppp_components,
+            updated_means,
+            updated_covariances,
             loglikelihoods,
-        ) = GaussianDensity.update_states_with_likelihoods_by_single_measurement(intensity, measurement, meas_model)
+        ) = density.update_states_with_likelihoods_by_multiple_measurements(intensity, measurements, meas_model, kalman_gain)
 
-        # Compute predicted likelihood
-        assert len(intensity) == len(loglikelihoods)
-        log_weights = np.array([np.log(detection_probability) + ppp_component.log_weight + loglikelihood for ppp_component, loglikelihood in zip(intensity, loglikelihoods)])
+        # Compute predicted likelihood, in place of loglikelihoods buffer
+        log_weights = np.add(loglikelihoods, np.array(intensity.log_weights)[:, np.newaxis], out=loglikelihoods)
+        log_weights += log_detection_probability
 
         # 2. Perform Gaussian moment matching for the updated object state densities
         # resulted from being updated by the same detection.
-        normalized_log_weights, log_sum = normalize_log_weights(log_weights)
-        merged_state = density.moment_matching_vectorized(normalized_log_weights, updated_ppp_components)
+        weights, log_sums = PoissonRFS.exp_normalize_log_weights(log_weights)
+        merged_means, merged_covariances = density.moment_matching_batched(weights, updated_means, updated_covariances, weights_in_log_domain=False)
 
         # 3. The returned likelihood should be the sum of the predicted likelihoods calculated f
         # or each mixture component in the PPP intensity and the clutter intensity.
-        # (You can make use of the normalizeLogWeights function to achieve this.)
-        log_likelihood = scipy.special.logsumexp([log_sum, np.log(clutter_intensity)])
+        # Stable two-term logsumexp of [log_sums, log_clutter_intensity] without the scipy overhead.
+        log_likelihoods = np.maximum(log_sums, log_clutter_intensity) + np.log1p(np.exp(-np.abs(log_sums - log_clutter_intensity)))
 
         # 4. The returned existence probability of the Bernoulli component
         # is the ratio between the sum of the predicted likelihoods
@@ -109,22 +193,251 @@ class PoissonRFS:
         # (Be careful that the returned existence probability is
         # in decimal scale while the likelihoods you calculated
         # beforehand are in logarithmic scale)
-        existence_probability = np.exp(log_sum - log_likelihood)
-        bernoulli = Bernoulli(merged_state, existence_probability, None)
-        cost = -log_likelihood
-        return SingleTargetHypothesis(
-            bernoulli=bernoulli,
-            log_likelihood=log_likelihood,
-            cost=cost,
-            meas_idx=meas_idx,
-            sth_id=0,
+        existence_probabilities = np.exp(log_sums - log_likelihoods)
+
+        return PoissonRFS.create_single_target_hypotheses(merged_means, merged_covariances, log_likelihoods, existence_probabilities)
+
+    @staticmethod
+    def exp_normalize_log_weights(log_weights: np.ndarray, segment_starts: np.ndarray = None, measurement_indices: np.ndarray = None):
+        """logsumexp by hand over the weights of every measurement, done in place of log_weights buffer:
+        exponentiated weights are kept and normalized for moment matching
+        instead of exponentiating normalized log weights once again
+
+        log_weights np.ndarray
+            PPP size x number of measurements, or (component, measurement) pairs ordered by measurement
+            if segment_starts (first pair of every measurement) and measurement_indices (of every pair) are given
+
+        Returns normalized weights and log of the sum of weights of every measurement
+        """
+        if segment_starts is None:
+            max_log_weights = log_weights.max(axis=0)
+            per_weight = slice(None)
+        else:
+            max_log_weights = np.maximum.reduceat(log_weights, segment_starts)
+            per_weight = measurement_indices
+        weights = np.exp(np.subtract(log_weights, max_log_weights[per_weight], out=log_weights), out=log_weights)
+        sum_weights = weights.sum(axis=0) if segment_starts is None else np.add.reduceat(weights, segment_starts)
+        weights /= sum_weights[per_weight]
+        return weights, max_log_weights + np.log(sum_weights)
+
+    @staticmethod
+    def gated_detected_update(
+        measurements: np.ndarray,
+        intensity: GaussianMixture,
+        meas_model: MeasurementModel,
+        log_detection_probability: float,
+        log_clutter_intensity: float,
+        gating_size: float,
+        density=GaussianDensity,
+        kalman_gain: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None,
+    ) -> List[SingleTargetHypothesis]:
+        """Same as detected_update_batch, but every measurement is updated only with PPP components
+        inside its gate, the gate is computed in the same pass as the update,
+        see GaussianDensity.update_states_with_likelihoods_in_gates.
+        A measurement outside of every gate gets a Bernoulli with zero existence probability
+        and likelihood of clutter.
+        Unlike gating, the gate uses the full innovation covariance S = H @ P @ H.T + R.
+        """
+        measurements = np.asarray(measurements, dtype=float)
+        if kalman_gain is None:
+            kalman_gain = density.get_Kalman_gain_vectorized(intensity, meas_model)
+        (
+            component_indices,
+            measurement_indices,
+            updated_means,
+            loglikelihoods,
+            outside_gates,
+        ) = density.update_states_with_likelihoods_in_gates(intensity, measurements, meas_model, gating_size, kalman_gain)
+        return PoissonRFS.merge_gated_pairs(
+            component_indices,
+            measurement_indices,
+            updated_means,
+            loglikelihoods,
+            kalman_gain[3],
+            intensity,
+            log_detection_probability,
+            log_clutter_intensity,
+            density,
+            outside_gates,
         )
 
+    @staticmethod
+    def merge_gated_pairs(
+        component_indices: np.ndarray,
+        measurement_indices: np.ndarray,
+        updated_means: np.ndarray,
+        loglikelihoods: np.ndarray,
+        updated_covariances: np.ndarray,
+        intensity: GaussianMixture,
+        log_detection_probability: float,
+        log_clutter_intensity: float,
+        density=GaussianDensity,
+        outside_gates: np.ndarray = None,
+    ) -> List[SingleTargetHypothesis]:
+        """Merges updated (component, measurement) pairs, ordered by measurement, into one new Bernoulli
+        per measurement, see detected_update_batch. Every measurement must have at least one pair.
+
+        outside_gates np.ndarray
+            measurements outside of every gate, they are clutter: zero existence probability
+            and clutter likelihood, their pair gives a placeholder state only
+        """
+        segment_starts = np.flatnonzero(np.diff(measurement_indices, prepend=-1))
+        log_weights = np.add(loglikelihoods, np.array(intensity.log_weights)[component_indices], out=loglikelihoods)
+        log_weights += log_detection_probability
+
+        weights, log_sums = PoissonRFS.exp_normalize_log_weights(log_weights, segment_starts, measurement_indices)
+        if outside_gates is not None:
+            log_sums[outside_gates] = -np.inf
+
+        merged_means, merged_covariances = density.moment_matching_segments(
+            weights,
+            updated_means,
+            updated_covariances[component_indices],
+            segment_starts,
+            weights_in_log_domain=False,
+        )
+
+        log_likelihoods = np.maximum(log_sums, log_clutter_intensity) + np.log1p(np.exp(-np.abs(log_sums - log_clutter_intensity)))
+        existence_probabilities = np.exp(log_sums - log_likelihoods)
+        return PoissonRFS.create_single_target_hypotheses(merged_means, merged_covariances, log_likelihoods, existence_probabilities)
+
+    @staticmethod
+    def detected_update_numba(
+        measurements: np.ndarray,
+        intensity: GaussianMixture,
+        meas_model: MeasurementModel,
+        log_detection_probability: float,
+        log_clutter_intensity: float,
+        density=GaussianDensity,
+        kalman_gain: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None,
+        max_workers: int = 1,
+        executor: ThreadPoolExecutor = None,
+        gating_size: float = None,
+    ) -> List[SingleTargetHypothesis]:
+        """Same as detected_update_batch, but every measurement is handled by a Numba compiled kernel.
+        Requires numba, see detected_update_kernels.NUMBA_AVAILABLE.
+
+        max_workers int
+            number of threads measurements are split between, the kernel releases the GIL
+        executor ThreadPoolExecutor
+            pool of max_workers threads reused between calls, without it a pool is created per call
+        gating_size float
+            if given, every measurement is updated only with PPP components inside its gate,
+            same result as gated_detected_update
+        """
+        if len(measurements) == 0:
+            return []
+        if kalman_gain is None:
+            kalman_gain = density.get_Kalman_gain_vectorized(intensity, meas_model)
+        H_x, _, K, next_covariances, L = kalman_gain
+
+        means = intensity.states_np
+        predicted_measurements = means @ H_x.T
+        log_determinants = density.cholesky_log_determinants(L)
+        log_weights = np.array(intensity.log_weights)
+        measurements = np.asarray(measurements, dtype=float)
+        detected_update_kernel = get_detected_update_kernel(means.shape[1])
+        # kernel is compiled with fastmath, so no gate is the largest finite gate instead of inf
+        gating_size = np.finfo(float).max if gating_size is None else float(gating_size)
+
+        def update_chunk(measurements_chunk: np.ndarray):
+            # every thread gets its own scratch buffers
+            buffers = DetectedUpdateBuffers.allocate(*means.shape, measurements.shape[1])
+            return [
+                detected_update_kernel(
+                    means,
+                    next_covariances,
+                    predicted_measurements,
+                    L,
+                    log_determinants,
+                    K,
+                    log_weights,
+                    measurement,
+                    log_detection_probability,
+                    log_clutter_intensity,
+                    gating_size,
+                    buffers.updated_means,
+                    buffers.component_log_weights,
+                    buffers.in_gate,
+                    buffers.innovation,
+                    buffers.whitened_innovation,
+                )
+                for measurement in measurements_chunk
+            ]
+
+        if max_workers > 1 and len(measurements) > 1:
+            chunks = np.array_split(measurements, min(max_workers, len(measurements)))
+            if executor is None:
+                with ThreadPoolExecutor(max_workers=len(chunks)) as call_executor:
+                    updates = [update for chunk_updates in call_executor.map(update_chunk, chunks) for update in chunk_updates]
+            else:
+                updates = [update for chunk_updates in executor.map(update_chunk, chunks) for update in chunk_updates]
+        else:
+            updates = update_chunk(measurements)
+        merged_means, merged_covariances, log_likelihoods, existence_probabilities = zip(*updates)
+        return PoissonRFS.create_single_target_hypotheses(merged_means, merged_covariances, log_likelihoods, existence_probabilities)
+
+    @staticmethod
+    def detected_update_jax(
+        measurements: np.ndarray,
+        intensity: GaussianMixture,
+        meas_model: MeasurementModel,
+        log_detection_probability: float,
+        log_clutter_intensity: float,
+        gating_size: float = None,
+    ) -> List[SingleTargetHypothesis]:
+        """Same as detected_update_batch, but runs on JAX device vectorized over measurements and PPP components.
+        Requires jax, see detected_update_kernels.JAX_AVAILABLE.
+        With gating_size, components outside of a measurement gate are masked out, as in gated_detected_update.
+
+        PPP components and measurements are padded to bucket sizes (see jax_bucket_size),
+        so the jitted update is not compiled again for every PPP size and number of measurements.
+        Padded components repeat the last one with zero weight, results of padded measurements are dropped.
+        """
+        n_measurements = len(measurements)
+        if n_measurements == 0:
+            return []
+        means = intensity.states_np
+        n_padded_components = jax_bucket_size(len(means)) - len(means)
+        n_padded_measurements = jax_bucket_size(n_measurements) - n_measurements
+        with jax_x64():
+            updates = _detected_update_jax(
+                np.pad(means, ((0, n_padded_components), (0, 0)), mode="edge"),
+                np.pad(intensity.covariances_np, ((0, n_padded_components), (0, 0), (0, 0)), mode="edge"),
+                np.pad(np.array(intensity.log_weights), (0, n_padded_components), constant_values=-np.inf),
+                np.pad(np.asarray(measurements, dtype=float), ((0, n_padded_measurements), (0, 0)), mode="edge"),
+                meas_model.H(means),
+                meas_model.R,
+                log_detection_probability,
+                log_clutter_intensity,
+                np.inf if gating_size is None else float(gating_size),
+            )
+            merged_means, merged_covariances, log_likelihoods, existence_probabilities = (np.asarray(update)[:n_measurements] for update in updates)
+        return PoissonRFS.create_single_target_hypotheses(merged_means, merged_covariances, log_likelihoods, existence_probabilities)
+
+    @staticmethod
+    def create_single_target_hypotheses(merged_means, merged_covariances, log_likelihoods, existence_probabilities) -> List[SingleTargetHypothesis]:
+        """Wraps merged PPP updates (one per measurement) into new single target hypotheses"""
+        return [
+            SingleTargetHypothesis(
+                bernoulli=Bernoulli(Gaussian(merged_means[meas_idx], merged_covariances[meas_idx]), existence_probabilities[meas_idx], None),
+                log_likelihood=log_likelihoods[meas_idx],
+                cost=-log_likelihoods[meas_idx],
+                meas_idx=meas_idx,
+                sth_id=0,
+            )
+            for meas_idx in range(len(log_likelihoods))
+        ]
+
     @Timer(name="update ppp componentns for missed detetion")
-    def undetected_update(self, detection_probability) -> None:
-        """Performs PPP update for missed detection."""
+    def undetected_update(self, log_missdetection_probability: float) -> None:
+        """Performs PPP update for missed detection.
+
+        log_missdetection_probability : float
+            log(1 - P_D), precomputed once by the tracker
+        """
         for ppp_component in self.intensity:
-            ppp_component.log_weight += np.log(1 - detection_probability)
+            ppp_component.log_weight += log_missdetection_probability
 
     def prune(self, threshold: float) -> None:
         self.intensity = GaussianMixture([ppp_component for ppp_component in self.intensity if ppp_component.log_weight > threshold])
@@ -132,19 +445,26 @@ class PoissonRFS:
     def predict(
         self,
         motion_model: MotionModel,
-        survival_probability: float,
+        log_survival_probability: float,
         density: GaussianDensity,
         dt: float,
     ) -> None:
         """Performs prediciton step for PPP components hypothesing undetected objects.
-        Birth components will be added in another method."""
+        Birth components will be added in another method.
+
+        log_survival_probability : float
+            log(P_S), precomputed once by the tracker
+        """
         assert isinstance(motion_model, MotionModel)
-        assert isinstance(survival_probability, float)
+        assert isinstance(log_survival_probability, float)
         assert isinstance(dt, float)
 
-        for ppp_component in self.intensity:
-            ppp_component.log_weight += np.log(survival_probability)
-            ppp_component.gaussian = density.predict(ppp_component.gaussian, motion_model, dt)
+        if len(self.intensity) == 0:
+            return
+        next_states, next_covariances = density.predict_vectorized(self.intensity, motion_model, dt)
+        for ppp_component, next_state, next_covariance in zip(self.intensity, next_states, next_covariances):
+            ppp_component.log_weight += log_survival_probability
+            ppp_component.gaussian = Gaussian(next_state, next_covariance)
 
     def birth(self, new_components: GaussianMixture):
         """Incorporate PPP birth intensity into PPP intensity
@@ -155,7 +475,7 @@ class PoissonRFS:
             [description]
         """
         assert isinstance(new_components, GaussianMixture)
-        self.intensity.extend(deepcopy(new_components))
+        self.intensity.extend(GaussianMixture([replace(ppp_component) for ppp_component in new_components]))
 
     def gating(
         self,
@@ -165,10 +485,15 @@ class PoissonRFS:
         gating_size: float,
     ) -> Tuple[np.ndarray, np.ndarray]:
         """Returns measurement indices inside the gate of undetected objects (PPP)"""
-        gating_matrix_undetected = np.full(shape=[self.intensity.size, len(measurements)], fill_value=False)  # poisson size x number of measurements
-        used_measurement_undetected_indices = np.full(shape=[len(measurements)], fill_value=False)
-
-        for ppp_idx in range(self.intensity.size):
-            _, gating_matrix_undetected[ppp_idx, :] = density_handler.ellipsoidal_gating(self.intensity[ppp_idx].gaussian, measurements, meas_model, gating_size)
-            used_measurement_undetected_indices = np.logical_or(used_measurement_undetected_indices, gating_matrix_undetected[ppp_idx])
+        if self.intensity.size == 0 or len(measurements) == 0:
+            gating_matrix_undetected = np.full(shape=[self.intensity.size, len(measurements)], fill_value=False)
+        else:
+            gating_matrix_undetected = density_handler.ellipsoidal_gating_vectorized(
+                self.intensity.states_np,
+                self.intensity.covariances_np,
+                measurements,
+                meas_model,
+                gating_size,
+            )  # poisson size x number of measurements
+        used_measurement_undetected_indices = gating_matrix_undetected.any(axis=0)
         return (gating_matrix_undetected, used_measurement_undetected_indices)
@@ -29,17 +29,6 @@ class SingleTargetHypothesis:
     def __repr__(self) -> str:
         return self.__class__.__name__ + (f"(log_likelihood={self.log_likelihood:.2f}, " f"bernoulli={self.bernoulli}, " f"cost={self.cost:.2f}, " f"sth_id={self.sth_id}")
 
-    def create_missdetection_hypothesis(self, detection_probability: float, sth_id):
-        missdetection_bernoulli = self.bernoulli.undetected_update_state(detection_probability)
-        missdetection_loglikelihood = self.bernoulli.undetected_update_loglikelihood(detection_probability)
-        missdetection_hypothesis = SingleTargetHypothesis(
-            bernoulli=missdetection_bernoulli,
-            log_likelihood=missdetection_loglikelihood.item(),
-            cost=0,
-            sth_id=sth_id,
-        )
-        return missdetection_hypothesis
-
     def create_detection_hypothesis(
         self,
         measurement: np.ndarray,
@@ -65,7 +54,7 @@ class SingleTargetHypothesis:
     def create_detection_hypotheses(
         self,
         measurements: ObservationList,
-        detection_probability: float,
+        log_detection_probability: float,
         meas_model: MeasurementModel,
         density: GaussianDensity,
         sth_ids: Tuple[int],
@@ -79,9 +68,10 @@ class SingleTargetHypothesis:
             measurement_model=meas_model,
         )
 
-        missdetection_log_likelihood = self.missdetection_hypothesis.log_likelihood or self.bernoulli.undetected_update_loglikelihood(detection_probability)
+        # missdetection hypothesis is created right before by MBM.update
+        missdetection_log_likelihood = self.missdetection_hypothesis.log_likelihood
 
-        loglikelihoods = GaussianDensity.update_likelihoods_vectorized(next_states, next_covariances, measurements, meas_model) + np.log(detection_probability) + np.log(1.0)
+        loglikelihoods = GaussianDensity.update_likelihoods_vectorized(next_states, next_covariances, measurements, meas_model) + log_detection_probability
 
         detection_hypotheses = {
             idx: SingleTargetHypothesis(
@@ -67,9 +67,13 @@ class PMBM:
 
         # models death of an object (aka P_S)
         self.survival_probability = survival_probability
+        # log constants are Python floats, so per-component += does not go through NumPy scalars
+        self.log_survival_probability = float(np.log(survival_probability))
 
         # models detection (and missdetection) of an object (aka P_D)
         self.detection_probability = detection_probability
+        self.log_detection_probability = float(np.log(detection_probability))
+        self.log_missdetection_probability = float(np.log(1 - detection_probability))
 
         # Interval for ellipsoidal gating (aka P_G)
         self.gating_percentage = gating_percentage
@@ -92,6 +96,12 @@ class PMBM:
             f"PPP components={len(self.PPP.intensity)}, "
         )
 
+    def close(self):
+        """Releases worker pools of the tracker"""
+        self.assingner_pool.close()
+        self.assingner_pool.join()
+        self.PPP.close()
+
     def step(self, measurements: ObservationList, dt: float, ego_pose: Dict = None):
         if ego_pose is None:
             ego_pose = {"translation": (0.0, 0.0, 0.0), "rotation": (0.0, 0.0, 0.0, 0.0)}
@@ -125,7 +135,7 @@ class PMBM:
         assert isinstance(survival_probability, float)
 
         self.MBM.predict(motion_model, survival_probability, density, dt)
-        self.PPP.predict(motion_model, survival_probability, density, dt)
+        self.PPP.predict(motion_model, self.log_survival_probability, density, dt)
         self.PPP.birth(birth_model)
 
     @Timer(name="PMBM update step")
@@ -140,20 +150,22 @@ class PMBM:
 
         new_tracks = self.PPP.get_targets_detected_for_first_time(
             measurements,
-            self.sensor_model.intensity_c,
+            self.sensor_model.log_intensity_c,
             self.meas_model,
-            self.detection_probability,
+            self.log_detection_probability,
+            gating_size=self.gating_size,
         )
 
         self.MBM.update(
             self.detection_probability,
+            self.log_detection_probability,
             measurements,
             self.meas_model,
             self.density,
         )
 
         # Update of PPP intensity for undetected objects that remain undetected
-        self.PPP.undetected_update(self.detection_probability)
+        self.PPP.undetected_update(self.log_missdetection_probability)
 
         lg.debug(f"\n   new tracks {new_tracks} \n")
         lg.debug(f"\n   current PPP components \n {self.PPP.intensity}")
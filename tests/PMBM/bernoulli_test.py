@@ -7,7 +7,10 @@ from src.common.gaussian_density import GaussianDensity
 from src.common.state import Gaussian
 from src.measurement_models import ConstantVelocityMeasurementModel
 from src.motion_models import ConstantVelocityMotionModel
-from src.trackers.multiple_object_trackers.PMBM.common.bernoulli import Bernoulli
+from src.trackers.multiple_object_trackers.PMBM.common.bernoulli import (
+    Bernoulli,
+    BernoulliArray,
+)
 
 
 @pytest.fixture
@@ -117,3 +120,31 @@ def test_bern_update_state(initial_bernoulli, neighbour_measurement, cv_measurem
     np.testing.assert_allclose(new_bernoulli.existence_probability, ref_r, rtol=0.01)
     np.testing.assert_allclose(new_bernoulli.state.x, ref_state_x, rtol=0.01)
     np.testing.assert_allclose(new_bernoulli.state.P, ref_state_P, rtol=0.01)
+
+
+def test_bern_array_undetected_update(initial_bernoulli, P_D):
+    bernoullis = [deepcopy(initial_bernoulli) for _ in range(3)]
+    for bernoulli, existence_probability in zip(bernoullis, [0.1, 0.6, 0.99]):
+        bernoulli.existence_probability = existence_probability
+
+    new_berns, log_likelihoods_undetected = BernoulliArray.from_bernoullis(bernoullis).undetected_update(P_D)
+
+    assert len(new_berns) == len(bernoullis)
+    for idx, bern in enumerate(bernoullis):
+        np.testing.assert_allclose(new_berns[idx].existence_probability, bern.undetected_update_state(P_D).existence_probability)
+        np.testing.assert_allclose(log_likelihoods_undetected[idx], bern.undetected_update_loglikelihood(P_D))
+        assert new_berns[idx].state == bern.state
+
+
+def test_bern_array_bind(initial_bernoulli, P_S):
+    bernoullis = [deepcopy(initial_bernoulli) for _ in range(3)]
+    for bernoulli, existence_probability in zip(bernoullis, [0.1, 0.6, 0.99]):
+        bernoulli.existence_probability = existence_probability
+
+    bernoulli_array = BernoulliArray.from_bernoullis(bernoullis, bind=True)
+    bernoulli_array.predict_existence(P_S)
+
+    np.testing.assert_allclose([bern.existence_probability for bern in bernoullis], P_S * np.array([0.1, 0.6, 0.99]))
+    bernoullis[1].existence_probability = 0.5
+    assert bernoulli_array.existence_probability[1] == 0.5
+    assert bernoulli_array[1].existence_probability == 0.5
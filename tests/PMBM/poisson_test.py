@@ -5,7 +5,7 @@ import numpy as np
 import pytest
 from scipy.special import logsumexp
 
-from src.common import GaussianDensity, GaussianMixture
+from src.common import GaussianDensity, GaussianMixture, normalize_log_weights
 from src.configs import SensorModelConfig
 from src.measurement_models import ConstantVelocityMeasurementModel
 from src.motion_models import ConstantVelocityMotionModel
@@ -26,6 +26,22 @@ def clutter_intensity():
     return 0.7 / 100
 
 
+@pytest.fixture
+def measurements():
+    """first two measurements are near the PPP components, the last one is far from both"""
+    return np.array([[-410.0, 200.0], [-390.0, -210.0], [0.0, 0.0]])
+
+
+def assert_same_hypotheses(new_sths, ref_sths, atol=0.0):
+    assert len(new_sths) == len(ref_sths)
+    for new_sth, ref_sth in zip(new_sths, ref_sths):
+        assert new_sth.meas_idx == ref_sth.meas_idx
+        np.testing.assert_almost_equal(new_sth.log_likelihood, ref_sth.log_likelihood)
+        np.testing.assert_almost_equal(new_sth.bernoulli.existence_probability, ref_sth.bernoulli.existence_probability)
+        np.testing.assert_allclose(new_sth.bernoulli.state.x, ref_sth.bernoulli.state.x, atol=atol)
+        np.testing.assert_allclose(new_sth.bernoulli.state.P, ref_sth.bernoulli.state.P, atol=atol)
+
+
 def test_PPP_predict_linear_motion(initial_PPP_intensity_linear, clutter_intensity):
     survival_probability = 0.9
 
@@ -36,7 +52,7 @@ def test_PPP_predict_linear_motion(initial_PPP_intensity_linear, clutter_intensi
 
     # Set Poisson RFS
     PPP = PoissonRFS(intensity=initial_PPP_intensity_linear)
-    PPP.predict(motion_model, survival_probability, GaussianDensity, dt)
+    PPP.predict(motion_model, np.log(survival_probability), GaussianDensity, dt)
 
     # check multiply of weight in log domain
     PPP_ref_w = np.array([current_weight + np.log(survival_probability) for current_weight in initial_PPP_intensity_linear.log_weights])
@@ -79,7 +95,7 @@ def test_PPP_undetected_update(initial_PPP_intensity_linear):
 
     PPP = PoissonRFS(intensity=initial_PPP_intensity_linear)
 
-    PPP.undetected_update(detection_probability)
+    PPP.undetected_update(np.log(1 - detection_probability))
 
     PPP_weights_ref = np.array([log_weight + np.log(1 - detection_probability) for log_weight in initial_PPP_intensity_linear.log_weights])
     np.testing.assert_almost_equal(
@@ -120,8 +136,8 @@ def test_PPP_detected_update(initial_PPP_intensity_linear):
         (0, measurements),
         copy.deepcopy(initial_PPP_intensity_linear),
         meas_model,
-        detection_probability,
-        sensor_model.intensity_c,
+        np.log(detection_probability),
+        sensor_model.log_intensity_c,
     )
 
     gated_PPP_component_indices = [idx for idx, _ in enumerate(initial_PPP_intensity_linear) if measurement_indices_in_PPP[idx] is True]
@@ -205,3 +221,139 @@ def test_PPP_pruning(initial_PPP_intensity_linear):
     PPP = PoissonRFS(intensity=modified_PPP_intensity)
     PPP.prune(threshold=np.log(0.01))
     assert len(PPP) == 1
+
+
+def test_PPP_detected_update_batch(initial_PPP_intensity_linear, measurements):
+    detection_probability = 0.8
+    clutter_intensity = 0.7 / 100
+    meas_model = ConstantVelocityMeasurementModel(sigma_r=10.0)
+
+    new_sths = PoissonRFS.detected_update_batch(
+        measurements,
+        initial_PPP_intensity_linear,
+        meas_model,
+        np.log(detection_probability),
+        np.log(clutter_intensity),
+    )
+
+    assert len(new_sths) == len(measurements)
+    kalman_gain = GaussianDensity.get_Kalman_gain_vectorized(initial_PPP_intensity_linear, meas_model)
+    for meas_idx, new_sth in enumerate(new_sths):
+        updated_components, log_likelihoods = GaussianDensity.update_states_with_likelihoods_by_single_measurement(
+            initial_PPP_intensity_linear,
+            measurements[meas_idx],
+            meas_model,
+            kalman_gain,
+        )
+        log_weights = np.log(detection_probability) + np.array(initial_PPP_intensity_linear.log_weights) + log_likelihoods
+        normalized_log_weights, log_sum = normalize_log_weights(log_weights)
+        ref_state = GaussianDensity.moment_matching_vectorized(normalized_log_weights, updated_components)
+        ref_log_likelihood = np.logaddexp(log_sum, np.log(clutter_intensity))
+
+        assert new_sth.meas_idx == meas_idx
+        np.testing.assert_almost_equal(new_sth.log_likelihood, ref_log_likelihood)
+        np.testing.assert_almost_equal(new_sth.bernoulli.existence_probability, np.exp(log_sum - ref_log_likelihood))
+        np.testing.assert_allclose(new_sth.bernoulli.state.x, ref_state.x)
+        np.testing.assert_allclose(new_sth.bernoulli.state.P, ref_state.P)
+
+
+def test_PPP_gated_detected_update(initial_PPP_intensity_linear, measurements):
+    log_detection_probability = np.log(0.8)
+    log_clutter_intensity = np.log(0.7 / 100)
+    meas_model = ConstantVelocityMeasurementModel(sigma_r=10.0)
+    gating_size = 9.21
+
+    args = (measurements, initial_PPP_intensity_linear, meas_model, log_detection_probability, log_clutter_intensity)
+    new_sths = PoissonRFS.gated_detected_update(*args, gating_size=gating_size)
+
+    # gate with the full innovation covariance S = H P H^T + R
+    _, S, _, _, _ = GaussianDensity.get_Kalman_gain_vectorized(initial_PPP_intensity_linear, meas_model)
+    innovations = measurements[np.newaxis] - (initial_PPP_intensity_linear.states_np @ meas_model.H(initial_PPP_intensity_linear.states_np).T)[:, np.newaxis]
+    gating_matrix = np.einsum("pmi,pij,pmj->pm", innovations, np.linalg.inv(S), innovations) < gating_size
+    # first measurement gates the first component only, second one the second component only,
+    # third one is outside of every gate
+    np.testing.assert_array_equal(gating_matrix, [[True, False, False], [False, True, False]])
+
+    ref_sths = [
+        PoissonRFS.detected_update_batch(measurements, GaussianMixture([initial_PPP_intensity_linear[0]]), *args[2:])[0],
+        PoissonRFS.detected_update_batch(measurements, GaussianMixture([initial_PPP_intensity_linear[1]]), *args[2:])[1],
+    ]
+    assert_same_hypotheses(new_sths[:2], ref_sths)
+
+    # measurement outside of every gate is clutter, state is the nearest component updated alone
+    clutter_sth, nearest_sth = new_sths[2], PoissonRFS.detected_update_batch(measurements, GaussianMixture([initial_PPP_intensity_linear[0]]), *args[2:])[2]
+    assert clutter_sth.meas_idx == 2
+    assert clutter_sth.bernoulli.existence_probability == 0.0
+    np.testing.assert_almost_equal(clutter_sth.log_likelihood, log_clutter_intensity)
+    np.testing.assert_allclose(clutter_sth.bernoulli.state.x, nearest_sth.bernoulli.state.x)
+    np.testing.assert_allclose(clutter_sth.bernoulli.state.P, nearest_sth.bernoulli.state.P)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_PPP_detected_update_numba(initial_PPP_intensity_linear, measurements, max_workers):
+    pytest.importorskip("numba")
+    log_detection_probability = np.log(0.8)
+    log_clutter_intensity = np.log(0.7 / 100)
+    meas_model = ConstantVelocityMeasurementModel(sigma_r=10.0)
+
+    args = (measurements, initial_PPP_intensity_linear, meas_model, log_detection_probability, log_clutter_intensity)
+    ref_sths = PoissonRFS.detected_update_batch(*args)
+    assert_same_hypotheses(PoissonRFS.detected_update_numba(*args, max_workers=max_workers), ref_sths)
+    assert_same_hypotheses(
+        PoissonRFS.detected_update_numba(*args, max_workers=max_workers, gating_size=9.21),
+        PoissonRFS.gated_detected_update(*args, gating_size=9.21),
+    )
+
+    # thread pool of the threaded detected update is kept by PPP between calls
+    PPP = PoissonRFS(initial_PPP_intensity_linear, threads_min_problem_size=0)
+    executor = PPP.get_executor()
+    assert_same_hypotheses(PoissonRFS.detected_update_numba(*args, max_workers=max_workers, executor=executor), ref_sths)
+    assert PPP.select_detected_update(len(measurements)).keywords["executor"] is executor
+    PPP.close()
+    assert executor._shutdown and PPP.get_executor() is not executor
+    PPP.close()
+
+
+class CoordinateTurnPositionMeasurementModel(ConstantVelocityMeasurementModel):
+    """Observes position of coordinate turn state (x, y, v, phi, omega)"""
+
+    def H(self, state_vector):
+        return np.array([[1.0, 0.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0, 0.0]])
+
+
+def test_PPP_detected_update_numba_coordinate_turn(initial_PPP_intensity_nonlinear):
+    pytest.importorskip("numba")
+    meas_model = CoordinateTurnPositionMeasurementModel(sigma_r=1.0)
+    measurements = np.array([[0.5, -0.5], [19.0, 21.0], [-20.0, 11.0]])
+
+    args = (measurements, initial_PPP_intensity_nonlinear, meas_model, np.log(0.8), np.log(0.7 / 100))
+    assert_same_hypotheses(PoissonRFS.detected_update_numba(*args), PoissonRFS.detected_update_batch(*args))
+
+
+def test_PPP_detected_update_jax(initial_PPP_intensity_linear, measurements):
+    pytest.importorskip("jax")
+    log_detection_probability = np.log(0.8)
+    log_clutter_intensity = np.log(0.7 / 100)
+    meas_model = ConstantVelocityMeasurementModel(sigma_r=10.0)
+
+    args = (measurements, initial_PPP_intensity_linear, meas_model, log_detection_probability, log_clutter_intensity)
+    new_sths = PoissonRFS.detected_update_jax(*args)
+    ref_sths = PoissonRFS.detected_update_batch(*args)
+
+    assert_same_hypotheses(new_sths, ref_sths, atol=1e-9)
+    # fewer measurements are padded to the same bucket size, padding does not change results
+    assert_same_hypotheses(PoissonRFS.detected_update_jax(measurements[:2], *args[1:]), ref_sths[:2], atol=1e-9)
+    assert_same_hypotheses(PoissonRFS.detected_update_jax(*args, gating_size=9.21), PoissonRFS.gated_detected_update(*args, gating_size=9.21), atol=1e-9)
+
+
+@pytest.mark.parametrize("gating_size", [None, 9.0])
+def test_PPP_detected_update_no_measurements(initial_PPP_intensity_linear, gating_size):
+    PPP = PoissonRFS(initial_PPP_intensity_linear)
+    new_tracks = PPP.get_targets_detected_for_first_time(
+        np.zeros((0, 2)),
+        np.log(0.7 / 100),
+        ConstantVelocityMeasurementModel(sigma_r=10.0),
+        np.log(0.8),
+        gating_size=gating_size,
+    )
+    assert new_tracks == {}
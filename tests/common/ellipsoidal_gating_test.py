@@ -55,3 +55,25 @@ def test_ellipsoidal_gating():
             measurement_model=meas_model,
             gating_size=gating_size,
         )
+
+
+def test_ellipsoidal_gating_vectorized():
+    meas_model = ConstantVelocityMeasurementModel(sigma_r=10.0)
+    gating_size = chi2.ppf(0.99, df=meas_model.dim)
+    rng = np.random.default_rng(42)
+
+    states = [Gaussian(x=rng.uniform(-50.0, 50.0, 4), P=rng.uniform(1.0, 100.0) * np.eye(4)) for _ in range(5)]
+    z = rng.uniform(-50.0, 50.0, (20, meas_model.dim))
+
+    meas_in_gate = GaussianDensity.ellipsoidal_gating_vectorized(
+        states=np.array([state.x for state in states]),
+        covariances=np.array([state.P for state in states]),
+        z=z,
+        measurement_model=meas_model,
+        gating_size=gating_size,
+    )
+
+    assert meas_in_gate.shape == (len(states), len(z))
+    for state, meas_in_gate_row in zip(states, meas_in_gate):
+        _, meas_in_gate_single = GaussianDensity.ellipsoidal_gating(state, z, meas_model, gating_size)
+        np.testing.assert_array_equal(meas_in_gate_row, meas_in_gate_single)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from src.common import Gaussian, GaussianDensity, GaussianMixture, WeightedGaussian
+from src.motion_models import (
+    ConstantVelocityMotionModel,
+    CoordinateTurnMotionModel,
+    MotionModel,
+)
+
+
+@pytest.mark.parametrize(
+    "motion_model",
+    [ConstantVelocityMotionModel(random_state=42, sigma_q=2.0), CoordinateTurnMotionModel(random_state=42, sigma_v=1.0, sigma_omega=0.1)],
+)
+def test_predict_vectorized(motion_model: MotionModel):
+    rng = np.random.default_rng(42)
+    components = []
+    for _ in range(10):
+        A = rng.normal(size=(motion_model.d, motion_model.d))
+        components.append(WeightedGaussian(0.0, Gaussian(x=rng.normal(size=motion_model.d), P=A @ A.T)))
+
+    next_states, next_covariances = GaussianDensity.predict_vectorized(GaussianMixture(components), motion_model, dt=1.0)
+
+    for component, next_state, next_covariance in zip(components, next_states, next_covariances):
+        ref_state = GaussianDensity.predict(component.gaussian, motion_model, dt=1.0)
+        np.testing.assert_allclose(next_state, ref_state.x)
+        np.testing.assert_allclose(next_covariance, ref_state.P)
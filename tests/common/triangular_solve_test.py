@@ -0,0 +1,13 @@
+import numpy as np
+
+from src.common import GaussianDensity
+
+
+def test_triangular_solves():
+    rng = np.random.default_rng(42)
+    A = rng.normal(size=(10, 4, 4))
+    L = np.linalg.cholesky(A @ np.transpose(A, axes=(0, 2, 1)) + np.eye(4))
+    B = rng.normal(size=(10, 4, 3))
+
+    np.testing.assert_allclose(GaussianDensity.solve_lower_triangular(L, B), np.linalg.solve(L, B))
+    np.testing.assert_allclose(GaussianDensity.solve_transposed_lower_triangular(L, B), np.linalg.solve(np.transpose(L, axes=(0, 2, 1)), B))